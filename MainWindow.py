@@ -143,6 +143,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.currentfid = None
         self.syncapi = SyncthingAPI(self)
+        self.syncapi.readInvalid = ns.show_invalid
         self.fs = FileSystem()
 
         self.readSettings()
@@ -251,6 +252,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def closeEvent(self, event):
         self.writeSettings()
+        self.syncapi.stopSession()
         event.accept()
 
     def folderSelected(self, index):
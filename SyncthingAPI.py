@@ -1,11 +1,42 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import hashlib
 import json
 import requests
 import types
-import urllib
+import collections
+import concurrent.futures
+import urllib3
+import urllib.parse
 import re
 from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# streaming is worth it only with the C backend, pure python one is much slower
+# than the buffered parsing
+try:
+    import ijson
+    if ijson.backend != 'yajl2_c':
+        ijson = None
+except ImportError:
+    ijson = None
+
+# orjson is faster and reads bytes directly, stdlib json is enough otherwise
+try:
+    import orjson
+    _jsonLoads = orjson.loads
+    _jsonDumps = orjson.dumps
+except ImportError:
+    _jsonLoads = json.loads
+    def _jsonDumps(d):
+        return json.dumps(d).encode('utf-8')
 
 try:
     from PySide2 import QtCore
@@ -19,6 +50,11 @@ import ItemProperty as iprop
 import logging
 logger = logging.getLogger("PySel.SyncthingAPI")
 
+_FILE_INFO_CACHE_SIZE = 10000
+_API_V_1_14_0 = 11400  # verStr2Num("1.14.0")
+_quote = urllib.parse.quote
+_URL_RE = re.compile(r'(?:(?P<scheme>https?)://)?(?P<host>[^:/ ]+):?(?P<port>[0-9]*).*')
+
 # the following url was used to build API
 # https://www.digitalocean.com/community/tutorials/how-to-use-web-apis-in-python-3
 
@@ -32,7 +68,18 @@ class SyncthingAPI:
         self.headerSelectStart = '//* Selective sync (generated by pyselective) *//'
         self.headerSelectFinish = '//* ignore all except selected *//'
         self._ignoreSelectiveList = []
+        self._ignoreSet = set()
+        self._ignorePrefixTrie = {}
+        self._fileInfoCache = collections.OrderedDict()  # (fid, fn): extended file info
+        self._etagCache = {}
+        self.readInvalid = False  # invalid flag is available only per file
+        self._loop = None
+        self._asession = None
+        self._exec = None
         self._parent = parent
+        # replaced by getVersion, the response needs no refinement since 1.14.0
+        self._refineBrowseFolderRequest = self._refineBrowseFolderRequestLegacy
+        self._streamBrowseFolderItems = self._streamBrowseFolderItemsLegacy
         # try set date format
         try:
             self.df = QtCore.Qt.ISODateWithMs
@@ -44,7 +91,58 @@ class SyncthingAPI:
     def startSession(self):
         self.session = requests.Session()
         self.session.verify = False
-        self.session.headers = {'X-API-Key': self.api_token}
+        # the warning is emitted on each request as verification is off
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                max_retries=Retry(total=2, backoff_factor=0.1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers = {'X-API-Key': self.api_token, 'Connection': 'keep-alive'}
+        self._etagCache = {}
+        # concurrent requests use aiohttp if possible, fall back to threads without it
+        if aiohttp is not None:
+            self._closeAsyncSession()
+            self._loop = asyncio.new_event_loop()
+        else:
+            if self._exec is not None:
+                self._exec.shutdown(wait=False)
+            self._exec = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
+    def stopSession(self):
+        self._closeAsyncSession()
+        if self._exec is not None:
+            self._exec.shutdown(wait=False)
+            self._exec = None
+
+    def _closeAsyncSession(self):
+        if self._loop is None:
+            return
+        if self._asession is not None:
+            self._loop.run_until_complete(self._asession.close())
+            self._asession = None
+        self._loop.close()
+        self._loop = None
+
+    def _getAsyncSession(self):
+        # aiohttp session must be created inside the running loop
+        if self._asession is None:
+            self._asession = aiohttp.ClientSession(
+                    headers={'X-API-Key': self.api_token},
+                    connector=aiohttp.TCPConnector(ssl=False))
+        return self._asession
+
+    def _runGathered(self, coros):
+        'runs coroutines concurrently, the rest are cancelled if one of them fails'
+        async def gather():
+            tasks = [asyncio.ensure_future(c) for c in coros]
+            try:
+                return await asyncio.gather(*tasks)
+            finally:
+                # do not leave pending tasks on the shared loop
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return self._loop.run_until_complete(gather())
 
     @property
     def api_url_base(self):
@@ -52,8 +150,7 @@ class SyncthingAPI:
 
     @api_url_base.setter
     def api_url_base(self, url):
-        p = '(?P<scheme>http[^:]?)?(?:\://)?(?P<host>[^:/ ]+).?(?P<port>[0-9]*).*'
-        m = re.search(p, url)
+        m = _URL_RE.search(url)
         self.api_hostname = m.group('host')
         s = m.group('scheme')
         if s:
@@ -69,73 +166,179 @@ class SyncthingAPI:
         if isinstance(response, types.GeneratorType):
             raise ImportError('It seems you use \"yieldfrom.request\" instead of \"requests\"')
 
+        return self._parseResponse(suff, response.status_code, response.content)
+
+    def _getRequestConditional(self, suff):
+        '''The same as _getRequest, but returns the previous object if the response is not changed.
+        The object is shared between calls, do not modify it'''
+        api_url = self.api_url_base + suff
+        etag, digest, value = self._etagCache.get(suff, (None, None, None))
+        headers = {'If-None-Match': etag} if etag else {}
+        response = self.session.get(api_url, headers = headers)
+
+        if response.status_code == 304:
+            return value
         if response.status_code == 200:
-            # logger.debug("Response content: {}".format(response.content))
-            return json.loads(response.content.decode('utf-8'))
-        elif response.status_code == 403:
+            # emulate conditional request by content hash if there is no etag
+            newdigest = hashlib.blake2b(response.content, digest_size=8).digest()
+            if newdigest == digest:
+                return value
+            value = self._parseResponse(suff, response.status_code, response.content)
+            self._etagCache[suff] = (response.headers.get('ETag'), newdigest, value)
+            return value
+        return self._parseResponse(suff, response.status_code, response.content)
+
+    async def _getRequestAsync(self, suff):
+        api_url = self.api_url_base + suff
+        # the same retries as the adapter of the sync session has
+        for attempt in range(3):
+            try:
+                async with self._getAsyncSession().get(api_url) as response:
+                    content = await response.read()
+                break
+            except aiohttp.ClientError as e:
+                if attempt == 2:
+                    raise requests.RequestException(f"{e} ({suff})") from e
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        return self._parseResponse(suff, response.status, content)
+
+    def _parseResponse(self, suff, status_code, content):
+        if status_code == 200:
+            # logger.debug("Response content: {}".format(content))
+            if not content:
+                return {}
+            return _jsonLoads(content)
+        elif status_code == 204:
+            return {}
+        elif status_code == 403:
             raise requests.RequestException('Forbidden, api token can be wrong')
-        elif response.status_code == 404:
-            logger.info("No object in the index: {0}".format(suff))
+        elif status_code == 404:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("No object in the index: %s", suff)
             return {}
-        elif response.status_code == 500:
+        elif status_code == 500:
             logger.info("Internal Server Error: {0} - {1}".format(
-                            suff, response.content.decode('utf-8')))
+                            suff, content.decode('utf-8')))
             raise requests.RequestException("Internal Server Error: {0} - {1}".format(
-                            suff, response.content.decode('utf-8')))
+                            suff, content.decode('utf-8')))
         else:
-            raise requests.RequestException('Wrong status code: '+ str(response.status_code) + " (" + suff + ")")
+            raise requests.RequestException('Wrong status code: '+ str(status_code) + " (" + suff + ")")
 
     def _postRequest(self, suff, d):
         api_url = self.api_url_base + suff
-        self.session.post(api_url,  json = d)
-
-    def _refineBrowseFolderRequest(self, d, rv = None):
-        # to avoid copying
-        if rv is None:
-            rv = []
-
-        if self.api_version >= self.verStr2Num("1.14.0"):
-            return d
+        body = _jsonDumps(d)
+        self.session.post(api_url, data = body,
+                headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))})
 
+    def _refineBrowseFolderRequestLegacy(self, d):
         # refine dict with list to list of dicts
         # if the version is lower than 1.14.0
-        for key in d:
-            if isinstance(d[key], dict):
-                rv.append({ 'name' : key, 'type': 'FILE_INFO_TYPE_DIRECTORY', 'children': [] })
-                self._refineBrowseFolderRequest(d[key], rv[-1]['children'])
-            else:
-                rv.append({ 'name' : key, 'type': 'FILE_INFO_TYPE_FILE'})
-        return rv
+        return list(self._refineBrowseFolderItems(d.items()))
+
+    def _refineBrowseFolderItems(self, items):
+        'yields refined entries for (name, content) pairs of the old browse response'
+        _isinstance = isinstance
+        _dict = dict
+        for key, value in items:
+            if not _isinstance(value, _dict):
+                yield { 'name' : key, 'type': 'FILE_INFO_TYPE_FILE'}
+                continue
+            rv = { 'name' : key, 'type': 'FILE_INFO_TYPE_DIRECTORY', 'children': [] }
+            # explicit stack instead of recursion, folders could be nested too deep
+            stack = [(value, rv['children'])]
+            while stack:
+                d, children = stack.pop()
+                for k, v in d.items():
+                    if _isinstance(v, _dict):
+                        children.append({ 'name' : k, 'type': 'FILE_INFO_TYPE_DIRECTORY', 'children': [] })
+                        stack.append((v, children[-1]['children']))
+                    else:
+                        children.append({ 'name' : k, 'type': 'FILE_INFO_TYPE_FILE'})
+            yield rv
+
+    def _browseRequest(self, suff):
+        'returns refined browse response, parses it while reading if ijson (yajl2_c) is available'
+        if ijson is None:
+            return self._refineBrowseFolderRequest(self._getRequest(suff))
+
+        response = self.session.get(self.api_url_base + suff, stream=True)
+        with response:
+            if response.status_code != 200:
+                return self._refineBrowseFolderRequest(
+                        self._parseResponse(suff, response.status_code, response.content))
+            # avoid buffering of the raw response, it could be huge for deep folders
+            response.raw.decode_content = True
+            return list(self._streamBrowseFolderItems(response.raw))
+
+    def _streamBrowseFolderItemsLegacy(self, raw):
+        'yields refined entries of the old browse response as they are parsed'
+        return self._refineBrowseFolderItems(ijson.kvitems(raw, '', use_float=True))
 
     def getFolderIter(self):
         return self._getRequest('stats/folder').keys()
 
+    def _getConfig(self):
+        # read on each refresh to follow changes, an unchanged config is not parsed again
+        return self._getRequestConditional('system/config')
+
     def getFoldersDict(self):
         dicts = self._getRequest('stats/folder')
-        cfgd = self._getRequest('system/config')
-        for k in dicts.keys():
-            for f in cfgd['folders']:
-                if f['id'] == k:
-                    dicts[k]['label'] = f['label']
-                    dicts[k]['path'] = f['path']
+        cfgd = self._getConfig()
+        by_id = {f['id']: f for f in cfgd['folders']}
+        for k, v in dicts.items():
+            if k in by_id:
+                v['label'] = by_id[k]['label']
+                v['path'] = by_id[k]['path']
         return dicts
 
     @lru_cache(maxsize=100)
     def getIgnoreList(self, fid):
-        rv = self._getRequest('db/ignores?folder={0}'.format(fid))['ignore']
-        logger.debug("Ignore list: {}".format(rv))
+        rv = self._getRequestConditional(f'db/ignores?folder={fid}')['ignore']
+        logger.debug("Ignore list: %s", rv)
         if rv is None:
             return []
         return rv
 
     def getIgnoreSelective(self, fid):
+        return list(self._getIgnoreSelective(fid))
+
+    @lru_cache(maxsize=100)
+    def _getIgnoreSelective(self, fid):
+        'the same as getIgnoreSelective, but the result is shared and immutable'
         l = self.getIgnoreList(fid)
-        if l.count(self.headerSelectStart) == 0 or \
-                l.count(self.headerSelectFinish) == 0:
-            return []
-        indstart = l.index(self.headerSelectStart)
-        indend = l.index(self.headerSelectFinish)
-        return l[indstart+1:indend]
+        indstart = None
+        for i, v in enumerate(l):
+            if indstart is None and v == self.headerSelectStart:
+                indstart = i
+            elif v == self.headerSelectFinish:
+                if indstart is None:
+                    break
+                return tuple(l[indstart+1:i])
+        return ()
+
+    @lru_cache(maxsize=100)
+    def _needServerIgnores(self, fid):
+        '''True if files can not be classified by the selective list only,
+        i.e. the template (both headers and '**' after them) is incomplete
+        or there are other patterns outside the selective section'''
+        insection = False
+        finished = False
+        catchall = False
+        for v in self.getIgnoreList(fid):
+            if v == self.headerSelectStart and not finished:
+                insection = True
+            elif v == self.headerSelectFinish and insection:
+                insection = False
+                finished = True
+            elif insection:
+                continue
+            elif v.strip() == '' or v.startswith('//'):
+                continue
+            elif finished and v.strip() == '**':
+                catchall = True  # ignore all except selected, it is assumed by _classifyIgnore
+            else:
+                return True
+        return not catchall
 
     def setIgnoreSelective(self, fid, il):
         l = self.getIgnoreList(fid)
@@ -149,61 +352,164 @@ class SyncthingAPI:
             il.append('\n')
 
         sendlist = l[:indstart+1] + il + l[indend:]
-        self._postRequest('db/ignores?folder={0}'.format(fid), {'ignore': sendlist})
+        self._postRequest(f'db/ignores?folder={fid}', {'ignore': sendlist})
+        self.getIgnoreList.cache_clear()
+        self._getIgnoreSelective.cache_clear()
+        self._needServerIgnores.cache_clear()
+        self.invalidateFolder(fid)
 
     def browseFolder(self, fid):
-        d = self._getRequest('db/browse?folder={0}'.format(fid))
-        self._ignoreSelectiveList = self.getIgnoreSelective(fid)
-        return self._refineBrowseFolderRequest(d)
+        rv = self._browseRequest(f'db/browse?folder={fid}')
+        self._updateIgnoreSelective(fid)
+        return rv
 
-    def browseFolderPartial(self, fid, path='', lev=0):
+    def _browsePartialSuffix(self, fid, path, lev):
         if path == '':
-            d = self._getRequest('db/browse?folder={0}&levels={1}'.format(fid, lev))
-        else:
-            d = self._getRequest('db/browse?folder={0}&prefix={1}&levels={2}'.format(fid, path, lev))
-        self._ignoreSelectiveList = self.getIgnoreSelective(fid) # TODO caching
+            return f'db/browse?folder={fid}&levels={lev}'
+        return f'db/browse?folder={fid}&prefix={path}&levels={lev}'
+
+    def browseFolderPartial(self, fid, path='', lev=0):
+        rv = self._browseRequest(self._browsePartialSuffix(fid, path, lev))
+        self._updateIgnoreSelective(fid)
+        return rv
+
+    async def browseFolderPartialAsync(self, fid, path='', lev=0):
+        'the same as browseFolderPartial, but could be gathered with others'
+        d = await self._getRequestAsync(self._browsePartialSuffix(fid, path, lev))
         return self._refineBrowseFolderRequest(d)
 
-    @lru_cache(maxsize=100)
+    def browseFolderPartialList(self, fid, paths, lev=0):
+        'returns browse result for each path of paths, requests are sent concurrently if possible'
+        if len(paths) == 0:
+            return []
+
+        self._updateIgnoreSelective(fid)
+        if self._loop is None:
+            if self._exec is None:
+                return [self.browseFolderPartial(fid, path, lev) for path in paths]
+            futures = [self._exec.submit(self._browseRequest, self._browsePartialSuffix(fid, path, lev))
+                    for path in paths]
+            return [f.result() for f in futures]
+
+        return self._runGathered([self.browseFolderPartialAsync(fid, path, lev) for path in paths])
+
     def getFileInfoExtended(self, fid, fn):
         'fn: file name with path relative to the parent folder'
-        rv = self._getRequest('db/file?folder={0}&file={1}'.format(fid, urllib.parse.quote(fn)))
+        rv = self._getCachedFileInfo(fid, fn)
+        if rv is None:
+            rv = self._getRequest(f'db/file?folder={fid}&file={_quote(fn)}')
+            rv = self._cacheFileInfo(fid, fn, self._extendSelective(fn, rv))
+        return rv
+
+    async def getFileInfoExtendedAsync(self, fid, fn):
+        'the same as getFileInfoExtended, but could be gathered with others'
+        rv = self._getCachedFileInfo(fid, fn)
+        if rv is None:
+            rv = await self._getRequestAsync(f'db/file?folder={fid}&file={_quote(fn)}')
+            rv = self._cacheFileInfo(fid, fn, self._extendSelective(fn, rv))
+        return rv
+
+    def _getCachedFileInfo(self, fid, fn):
+        rv = self._fileInfoCache.get((fid, fn))
+        if rv is not None:
+            self._fileInfoCache.move_to_end((fid, fn))
+        return rv
+
+    def _cacheFileInfo(self, fid, fn, rv):
+        self._fileInfoCache[(fid, fn)] = rv
+        if len(self._fileInfoCache) > _FILE_INFO_CACHE_SIZE:
+            self._fileInfoCache.popitem(last=False)
+        return rv
+
+    def invalidateFolder(self, fid):
+        'drop cached file info of the folder only'
+        for key in [k for k in self._fileInfoCache if k[0] == fid]:
+            del self._fileInfoCache[key]
+
+    def getFileInfoExtendedList(self, fid, fns):
+        'returns extended info for each name of fns, requests are sent concurrently if possible'
+        if self._loop is None and self._exec is None:
+            return [self.getFileInfoExtended(fid, fn) for fn in fns]
+        if self._loop is None:
+            # only requests are sent by threads, the cache is filled here
+            rv = [self._getCachedFileInfo(fid, fn) for fn in fns]
+            futures = [(i, self._exec.submit(self._getRequest, f'db/file?folder={fid}&file={_quote(fns[i])}'))
+                    for i in range(len(fns)) if rv[i] is None]
+            for i, f in futures:
+                rv[i] = self._cacheFileInfo(fid, fns[i], self._extendSelective(fns[i], f.result()))
+            return rv
+        if len(fns) == 0:
+            return []
+
+        return self._runGathered([self.getFileInfoExtendedAsync(fid, fn) for fn in fns])
+
+    def _extendSelective(self, fn, rv):
+        'fill ignored and partial state of the directory by selective list'
         if len(rv) > 0 and (iprop.Type[rv['local']['type']] is iprop.Type.DIRECTORY or rv['local']['type'] == 1):
-            if ("!/" + fn) in self._ignoreSelectiveList:
-                rv['local']['ignored'] = False
-                if ("/" + fn + "/**") in self._ignoreSelectiveList:
-                    ispartial = True
-                else:
-                    ispartial = False
-            else: # assume ignored by default as it is not in the list
-                rv['local']['ignored'] = True
-                ispartial = False
-
-            for ign in self._ignoreSelectiveList:
-                if ign.startswith("!/" + fn + "/"):
-                    ispartial = True
-                    # there is some content inside, so it can not be ignored
-                    rv['local']['ignored'] = False
-                    break
-                elif ("!/" + fn + "/").startswith(ign + "/") and \
-                        (ign[1:] + "/**") not in self._ignoreSelectiveList:
-                    # the parent is on the SelectiveList, so the item must be fully synced
-                    rv['local']['ignored'] = False
-                    ispartial = False
-            rv['local']['partial'] = ispartial
+            rv['local']['ignored'], rv['local']['partial'] = self._classifyIgnore(fn)
         return rv
 
+    def _updateIgnoreSelective(self, fid):
+        l = self._getIgnoreSelective(fid)
+        if l is self._ignoreSelectiveList:
+            return  # the same cached list, index is up to date
+        self._ignoreSelectiveList = l
+        self._ignoreSet = set(self._ignoreSelectiveList)
+        # trie of path segments of the included items ('!/...'),
+        # None key marks the included item and keeps if it is fully synced
+        trie = {}
+        for ign in self._ignoreSet:
+            if ign == "!":
+                node = trie
+            elif ign.startswith("!/"):
+                node = trie
+                for seg in ign[2:].split("/"):
+                    node = node.setdefault(seg, {})
+            else:
+                continue
+            node[None] = (ign[1:] + "/**") not in self._ignoreSet
+        self._ignorePrefixTrie = trie
+
+    def _classifyIgnore(self, fn):
+        'returns (ignored, partial) for the path fn by selective list'
+        node = self._ignorePrefixTrie
+        fullsync = node.get(None, False)
+        for seg in fn.split("/"):
+            node = node.get(seg)
+            if node is None:
+                break
+            fullsync = fullsync or node.get(None, False)
+        else:
+            if len(node) > (None in node):
+                # there is some content inside, so it can not be ignored
+                return False, True
+
+        if fullsync:
+            # the item or its parent is on the SelectiveList, so the item must be fully synced
+            return False, False
+        elif ("!/" + fn) in self._ignoreSet:
+            return False, ("/" + fn + "/**") in self._ignoreSet
+        # assume ignored by default as it is not in the list
+        return True, False
+
     def getFileInfoRaw(self, fid, fn):
         'fn: file name with path relative to the parent folder'
-        return self._getRequest('db/file?folder={0}&file={1}'.format(fid, urllib.parse.quote(fn)))
+        return self._getRequest(f'db/file?folder={fid}&file={_quote(fn)}')
 
     def getVersion(self):
         logger.debug("Try read syncthing version...")
         rv = self._getRequest('svc/report')['version']
         self.api_version = self.verStr2Num(rv)
+        if self.api_version >= _API_V_1_14_0:
+            self._refineBrowseFolderRequest = lambda d: d
+            self._streamBrowseFolderItems = lambda raw: ijson.items(raw, 'item', use_float=True)
+        else:
+            self._refineBrowseFolderRequest = self._refineBrowseFolderRequestLegacy
+            self._streamBrowseFolderItems = self._streamBrowseFolderItemsLegacy
         logger.debug("Ok: {0} (api {1})".format(rv, self.api_version))
         return rv
 
+    @lru_cache(maxsize=32)
     def verStr2Num(self, s):
         l = s.replace("v", "").split(".")
         # sometime the version could ends with rc1 or something else
@@ -214,7 +520,12 @@ class SyncthingAPI:
 
     def clearCache(self):
         self.getIgnoreList.cache_clear()
-        self.getFileInfoExtended.cache_clear()
+        self._fileInfoCache.clear()
+        self._getIgnoreSelective.cache_clear()
+        self._needServerIgnores.cache_clear()
+        self._ignoreSelectiveList = []
+        self._ignoreSet = set()
+        self._ignorePrefixTrie = {}
 
     def extendFileInfo(self, fid, l, path = '', psyncstate=iprop.SyncState.unknown):
         try:
@@ -230,10 +541,10 @@ class SyncthingAPI:
                     'size': fldi['global']['size'], 'type': fldi['global']['type']}
             l.append(faileditem)
             contents = self.browseFolderPartial(fid, path, lev=0) + [faileditem]
-            for cind in range(len(contents)):
-                if iprop.Type[contents[cind]['type']] is iprop.Type.DIRECTORY:
-                    contents[cind]['children'] = self.browseFolderPartial(fid,
-                                    contents[cind]['name'] if not path else path + '/' + contents[cind]['name'], lev=0)
+            dirs = [c for c in contents if iprop.Type[c['type']] is iprop.Type.DIRECTORY]
+            for c, children in zip(dirs, self.browseFolderPartialList(fid,
+                    [c['name'] if not path else path + '/' + c['name'] for c in dirs], lev=0)):
+                c['children'] = children
             QtWidgets.QMessageBox.warning(self._parent,
                     "Database read error",
                     "Force to read path \'{}\', but some other folders may be missed due to database inconsistency".format(name if not path else path + '/' + name) +
@@ -244,48 +555,48 @@ class SyncthingAPI:
 
         if path != '' and path[-1] != '/':
             path = path + '/'
+        contents_by_name = {c['name']: c for c in contents}
+        # the browse response has no modification time before api 1.14.0
+        # and never has the invalid flag, so read such items one by one,
+        # files are read as well if the ignore list is not just the template
+        serverignores = self._needServerIgnores(fid)
+        rawnames = [v['name'] for v in l if v['name'] in contents_by_name and \
+                (self.readInvalid or 'modTime' not in contents_by_name[v['name']] or \
+                (serverignores and iprop.Type[contents_by_name[v['name']]['type']] is not iprop.Type.DIRECTORY))]
+        extds = dict(zip(rawnames, self.getFileInfoExtendedList(fid, [path+n for n in rawnames])))
+        _DIR = iprop.Type.DIRECTORY
         for v in l:
-            extd = self.getFileInfoExtended( fid, path+v['name'])
-            if len(extd) == 0:  # there is no such file in database
+            c = contents_by_name.get(v['name'])
+            if c is None:  # there is no such file in database
                 continue
-            v['size'] = extd['global']['size']
-            v['modified'] = QtCore.QDateTime.fromString( extd['global']['modified'], self.df)
-            v['ignored'] = extd['local']['ignored']
-            v['invalid'] = extd['local']['invalid']
-
-            if iprop.Type[v['type']] is iprop.Type.DIRECTORY:
-                # TODO dict of dicts to avoid for
-                for c in contents:
-                    if c['name'] == v['name']:
-                        if 'children' in c:
-                            v['children'] = c['children']
-                        else:
-                            v['children'] = []
-
-            if iprop.Type[v['type']] is not iprop.Type.DIRECTORY:
-                pass
-            elif 'partial' in extd['local']:
-                v['partial'] = extd['local']['partial']
-            # seems the following case do not work at all as 'partial' exists forever
-            else: #do not believe 'ignore', check content
-                selcnt = 0
-                for v2 in v['children']:
-                    if self.getFileInfoExtended( \
-                            fid, path+v['name']+'/' + v2['name'])['local']['ignored'] == False:
-                        selcnt += 1
-
-                if selcnt == 0:
-                    v['partial'] = False
-                elif selcnt == len(v['children']):
-                    v['ignored'] = False
-                    v['partial'] = False
-                else:
-                    v['ignored'] = False
-                    v['partial'] = True
+            extd = extds.get(v['name'])
+            if extd is None:
+                v['size'] = c['size']
+                v['modified'] = QtCore.QDateTime.fromString( c['modTime'], self.df)
+                v['type'] = c['type']
+            elif len(extd) == 0:
+                continue
+            else:
+                v['size'] = extd['global']['size']
+                v['modified'] = QtCore.QDateTime.fromString( extd['global']['modified'], self.df)
+                v['invalid'] = extd['local']['invalid']
 
-            if 'partial' in v and v['partial']:
+            # the same rule whatever the source is, so --show-invalid does not change states
+            if extd is not None and serverignores and iprop.Type[v['type']] is not _DIR:
+                ignored, partial = extd['local']['ignored'], False
+            else:
+                ignored, partial = self._classifyIgnore(path+v['name'])
+            v['ignored'] = ignored
+
+            if iprop.Type[v['type']] is _DIR:
+                v['children'] = c.get('children', [])
+                v['partial'] = partial
+            else:
+                partial = False
+
+            if partial:
                 v['syncstate'] = iprop.SyncState.partial
-            elif not v['ignored']:
+            elif not ignored:
                 v['syncstate'] = iprop.SyncState.syncing
             elif psyncstate == iprop.SyncState.syncing:
                 # item ignored but the parent does not
@@ -296,29 +607,45 @@ class SyncthingAPI:
 
     def extendDirSizes(self, l):
         '''Return the size of the current folder'''
-        #logger.debug("extendDirSizes: {}".format(l))
-        size = 0
-        completed = True
-        for item in l:
-            logger.debug("extend Item Size: {}".format(item))
-            if not 'type' in item.keys():
-                completed = False
-                continue
-            if iprop.Type[item['type']] is iprop.Type.DIRECTORY:
-                if 'syncstate' in item.keys() and item['syncstate'] is iprop.SyncState.newlocal:  # let's skip local files for now
-                    continue
-                item['size'] = 0  # clear inode size
-                if 'children' in item.keys():
-                    item['extSize'] = self.extendDirSizes(item['children'])
-                    logger.debug("extend size={} for {}".format(item['extSize'], item))
+        _Type = iprop.Type
+        _DIR = iprop.Type.DIRECTORY
+        _NEW = iprop.SyncState.newlocal
+
+        def accumulate(rv, item):
+            if 'size' in item:
+                if 'extSize' in item:  # true for a folder
+                    rv['value'] += item['extSize']['value']
+                    rv['completed'] &= item['extSize']['completed'] if 'completed' in item['extSize'] else True
                 else:
-                    completed = False
-            if 'size' in item.keys():
-                if 'extSize' in item.keys():  # true for a folder
-                    size += item['extSize']['value']
-                    completed &= item['extSize']['completed'] if 'completed' in item['extSize'].keys() else True
-                else:
-                    size += item['size']
+                    rv['value'] += item['size']
+            else:
+                rv['completed'] = False
+
+        rv = {"value":0, "completed":True}
+        # post-order walk by explicit stack of (items iterator, size of the items, owner folder)
+        stack = [(iter(l), rv, None)]
+        while stack:
+            items, dirsize, owner = stack[-1]
+            for item in items:
+                logger.debug("extend Item Size: %s", item)
+                if 'type' not in item:
+                    dirsize['completed'] = False
+                    continue
+                if _Type[item['type']] is _DIR:
+                    if item.get('syncstate') is _NEW:  # let's skip local files for now
+                        continue
+                    item['size'] = 0  # clear inode size
+                    if 'children' in item:
+                        # go deeper, the item is accumulated when its children are done
+                        stack.append((iter(item['children']), {"value":0, "completed":True}, item))
+                        break
+                    else:
+                        dirsize['completed'] = False
+                accumulate(dirsize, item)
             else:
-                completed = False
-        return {"value":size, "completed":completed}
+                stack.pop()
+                if owner is not None:
+                    owner['extSize'] = dirsize
+                    logger.debug("extend size=%s for %s", dirsize, owner)
+                    accumulate(stack[-1][1], owner)
+        return rv